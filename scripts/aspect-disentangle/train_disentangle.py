@@ -18,7 +18,9 @@ Usage:
 """
 
 import argparse
+import copy
 import json
+import os
 import random
 from pathlib import Path
 
@@ -28,12 +30,19 @@ import torch.nn as nn
 import torch.nn.functional as F
 from torch.utils.data import DataLoader, Dataset
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 # ── paths ──────────────────────────────────────────────────────────────
 ROOT = Path(__file__).resolve().parents[2]
 DATA = ROOT / "data"
 ANALYSIS = DATA / "analysis"
 
 EMBEDDINGS_FILE = DATA / "folklore-embeddings.json"
+EMBEDDINGS_CACHE = EMBEDDINGS_FILE.with_suffix(".npy")
+EMBEDDINGS_CACHE_IDS = EMBEDDINGS_FILE.with_suffix(".ids.json")
 PAIRS_FILE = ANALYSIS / "contrastive-pairs.json"
 OUTPUT_WEIGHTS = ANALYSIS / "projection_weights.pt"
 OUTPUT_LOG = ANALYSIS / "training_log.json"
@@ -45,7 +54,9 @@ SUBSPACE_DIM = 128
 PROJ_DIM = NUM_AXES * SUBSPACE_DIM  # 384
 TEMPERATURE = 0.07
 BATCH_SIZE = 128
+NUM_WORKERS = 0  # batches are index pairs only; worker processes would cost more than they save
 SEED = 42
+CHECKPOINT_EVERY = 10  # epochs between writes of a pending best checkpoint
 
 
 class AspectProjection(nn.Module):
@@ -73,19 +84,27 @@ class AspectProjection(nn.Module):
 
 
 class ContrastivePairDataset(Dataset):
-    def __init__(self, pairs: list, embeddings: dict[str, np.ndarray]):
-        self.data = []
-        for a_id, b_id in pairs:
-            if a_id in embeddings and b_id in embeddings:
-                self.data.append((embeddings[a_id], embeddings[b_id]))
+    """Pairs stored as (a, b) row indices into the shared embedding matrix."""
+
+    def __init__(self, pairs: list, ids: list[str]):
+        ids = np.array(ids)
+
+        # Encode pair ids to row indices with one sorted lookup instead of a Python loop
+        order = np.argsort(ids)
+        pair_ids = np.array(pairs, dtype=str).reshape(-1, 2)
+        # Widest of the two fixed-width string dtypes, so no id gets truncated
+        common = np.result_type(ids, pair_ids)
+        sorted_ids = ids[order].astype(common)
+        pair_ids = pair_ids.astype(common)
+        pos = np.searchsorted(sorted_ids, pair_ids).clip(max=len(ids) - 1)
+        found = (sorted_ids[pos] == pair_ids).all(axis=1)
+        self.index = torch.from_numpy(order[pos[found]])
 
     def __len__(self):
-        return len(self.data)
+        return len(self.index)
 
     def __getitem__(self, idx):
-        a_emb, b_emb = self.data[idx]
-        return torch.tensor(a_emb, dtype=torch.float32), \
-               torch.tensor(b_emb, dtype=torch.float32)
+        return self.index[idx]
 
 
 def info_nce_loss(anchor: torch.Tensor, positive: torch.Tensor,
@@ -113,14 +132,58 @@ def pairwise_orthogonality_loss(subspaces: list[torch.Tensor]) -> torch.Tensor:
     return loss / max(count, 1)
 
 
-def load_embeddings() -> dict[str, np.ndarray]:
-    with open(EMBEDDINGS_FILE, "r", encoding="utf-8") as f:
-        data = json.load(f)
-    emb_dict = {}
-    for entry in data["entries"]:
-        emb_dict[entry["id"]] = np.array(entry["embedding"], dtype=np.float32)
-    print(f"Loaded {len(emb_dict)} embeddings, dim={len(next(iter(emb_dict.values())))}")
-    return emb_dict
+def _write_atomic(path: Path, write):
+    """Call write(f) on a temp file, fsync, then rename over `path`."""
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    with open(tmp, "wb") as f:
+        write(f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def save_checkpoint(state: dict, path: Path):
+    """Write a checkpoint atomically (see _write_atomic)."""
+    _write_atomic(path, lambda f: torch.save(state, f))
+
+
+def load_embeddings() -> tuple[list[str], np.ndarray]:
+    """Return entry ids and their embeddings as one (N, EMBED_DIM) fp32 matrix.
+
+    The parsed matrix is cached as .npy next to the JSON source and reused
+    until the source is modified again.
+    """
+    if (EMBEDDINGS_CACHE.exists() and EMBEDDINGS_CACHE_IDS.exists()
+            and EMBEDDINGS_CACHE.stat().st_mtime >= EMBEDDINGS_FILE.stat().st_mtime):
+        try:
+            matrix = np.load(EMBEDDINGS_CACHE)
+            with open(EMBEDDINGS_CACHE_IDS, "r", encoding="utf-8") as f:
+                ids = json.load(f)
+            if len(ids) == len(matrix):
+                print(f"Loaded {len(ids)} embeddings, dim={matrix.shape[1]} (cache)")
+                return ids, matrix
+            print("Embeddings cache is inconsistent; rebuilding from JSON")
+        except (OSError, ValueError, EOFError) as e:
+            print(f"Embeddings cache unreadable ({e}); rebuilding from JSON")
+
+    if orjson is not None:
+        data = orjson.loads(EMBEDDINGS_FILE.read_bytes())
+    else:
+        with open(EMBEDDINGS_FILE, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    entries = data["entries"]
+    matrix = np.empty((len(entries), EMBED_DIM), dtype=np.float32)
+    ids = []
+    for i, entry in enumerate(entries):
+        matrix[i] = entry["embedding"]
+        ids.append(entry["id"])
+    print(f"Loaded {len(ids)} embeddings, dim={matrix.shape[1]}")
+
+    # Ids first, matrix last: the matrix's mtime is what marks the cache fresh
+    _write_atomic(EMBEDDINGS_CACHE_IDS,
+                  lambda f: f.write(json.dumps(ids, ensure_ascii=False).encode("utf-8")))
+    _write_atomic(EMBEDDINGS_CACHE, lambda f: np.save(f, matrix))
+    return ids, matrix
 
 
 def load_pairs() -> dict[str, list]:
@@ -141,9 +204,14 @@ def train(args):
     device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
     print(f"Device: {device}")
 
-    embeddings = load_embeddings()
+    ids, matrix = load_embeddings()
     pairs = load_pairs()
 
+    # The Gemini embeddings are frozen: keep them resident on the device once
+    # (half precision on GPU to halve gather bandwidth) and batch by row index.
+    embed_dtype = torch.float16 if device.type == "cuda" else torch.float32
+    embeddings = torch.from_numpy(matrix).to(device=device, dtype=embed_dtype)
+
     # Build datasets for each axis
     axis_names = ["topic", "location", "phenomenon"]
     datasets = {}
@@ -154,9 +222,13 @@ def train(args):
         if key not in pairs:
             print(f"WARNING: {key} not found in pairs, skipping axis {axis}")
             continue
-        ds = ContrastivePairDataset([tuple(p) for p in pairs[key]], embeddings)
+        ds = ContrastivePairDataset(pairs[key], ids)
         datasets[axis] = ds
-        loaders[axis] = DataLoader(ds, batch_size=BATCH_SIZE, shuffle=True, drop_last=True)
+        # Pinned host memory lets the non_blocking index copies below overlap with compute
+        loaders[axis] = DataLoader(ds, batch_size=BATCH_SIZE, shuffle=True, drop_last=True,
+                                   pin_memory=device.type == "cuda",
+                                   num_workers=NUM_WORKERS,
+                                   persistent_workers=NUM_WORKERS > 0)
         print(f"  {axis} dataset: {len(ds)} pairs")
 
     if len(datasets) < 2:
@@ -175,82 +247,99 @@ def train(args):
 
     log = {"epochs": [], "losses": {k: [] for k in axis_names + ["orthog", "total"]}}
     best_loss = float("inf")
-
-    for epoch in range(1, args.epochs + 1):
-        model.train()
-        epoch_losses = {k: 0.0 for k in axis_names + ["orthog", "total"]}
-        n_batches = 0
-
-        iters = {axis: iter(loader) for axis, loader in loaders.items()}
-
-        while True:
-            total_loss = torch.tensor(0.0, device=device)
-            all_subspaces = []
-            any_batch = False
-
-            for axis_idx, axis in enumerate(axis_names):
-                if axis not in iters:
-                    continue
-                try:
-                    anchor, positive = next(iters[axis])
-                except StopIteration:
-                    continue
-
-                any_batch = True
-                anchor, positive = anchor.to(device), positive.to(device)
-                subspaces_a = model(anchor)
-                subspaces_p = model(positive)
-
-                # InfoNCE on the corresponding subspace
-                loss_axis = info_nce_loss(subspaces_a[axis_idx], subspaces_p[axis_idx])
-                total_loss = total_loss + loss_axis
-                epoch_losses[axis] += loss_axis.item()
-                all_subspaces.append(subspaces_a)
-
-            if not any_batch:
-                break
-
-            # Orthogonality: penalize all subspace pairs
-            if all_subspaces:
-                subspaces_for_orthog = all_subspaces[0]
-                loss_orthog = pairwise_orthogonality_loss(subspaces_for_orthog)
-                total_loss = total_loss + args.lambda_orthog * loss_orthog
-                epoch_losses["orthog"] += loss_orthog.item()
-
-            epoch_losses["total"] += total_loss.item()
-
-            optimizer.zero_grad()
-            total_loss.backward()
-            optimizer.step()
-            n_batches += 1
-
-        scheduler.step()
-
-        if n_batches > 0:
+    best_state = None  # best weights not yet written to disk
+
+    def flush_best():
+        nonlocal best_state
+        if best_state is None:
+            return
+        save_checkpoint({
+            "model_state_dict": best_state,
+            "config": {
+                "input_dim": EMBED_DIM,
+                "num_axes": NUM_AXES,
+                "subspace_dim": SUBSPACE_DIM,
+                "axis_names": axis_names,
+            },
+        }, OUTPUT_WEIGHTS)
+        best_state = None
+
+    # The finally writes a pending best even if training stops early (Ctrl+C, error)
+    try:
+        for epoch in range(1, args.epochs + 1):
+            model.train()
+            epoch_losses = {k: 0.0 for k in axis_names + ["orthog", "total"]}
+            n_batches = 0
+
+            iters = {axis: iter(loader) for axis, loader in loaders.items()}
+
+            while True:
+                total_loss = torch.tensor(0.0, device=device)
+                all_subspaces = []
+                any_batch = False
+
+                for axis_idx, axis in enumerate(axis_names):
+                    if axis not in iters:
+                        continue
+                    try:
+                        batch = next(iters[axis])
+                    except StopIteration:
+                        continue
+
+                    any_batch = True
+                    batch = batch.to(device, non_blocking=True)
+                    anchor = embeddings[batch[:, 0]].float()
+                    positive = embeddings[batch[:, 1]].float()
+                    subspaces_a = model(anchor)
+                    subspaces_p = model(positive)
+
+                    # InfoNCE on the corresponding subspace
+                    loss_axis = info_nce_loss(subspaces_a[axis_idx], subspaces_p[axis_idx])
+                    total_loss = total_loss + loss_axis
+                    epoch_losses[axis] += loss_axis.item()
+                    all_subspaces.append(subspaces_a)
+
+                if not any_batch:
+                    break
+
+                # Orthogonality: penalize all subspace pairs
+                if all_subspaces:
+                    subspaces_for_orthog = all_subspaces[0]
+                    loss_orthog = pairwise_orthogonality_loss(subspaces_for_orthog)
+                    total_loss = total_loss + args.lambda_orthog * loss_orthog
+                    epoch_losses["orthog"] += loss_orthog.item()
+
+                epoch_losses["total"] += total_loss.item()
+
+                optimizer.zero_grad()
+                total_loss.backward()
+                optimizer.step()
+                n_batches += 1
+
+            scheduler.step()
+
+            if n_batches > 0:
+                for k in epoch_losses:
+                    epoch_losses[k] /= n_batches
+
+            log["epochs"].append(epoch)
             for k in epoch_losses:
-                epoch_losses[k] /= n_batches
-
-        log["epochs"].append(epoch)
-        for k in epoch_losses:
-            log["losses"][k].append(epoch_losses[k])
-
-        if epoch % 10 == 0 or epoch == 1:
-            parts = [f"L_{k}={epoch_losses[k]:.4f}" for k in axis_names if k in loaders]
-            parts.append(f"L_orth={epoch_losses['orthog']:.4f}")
-            parts.append(f"L_total={epoch_losses['total']:.4f}")
-            print(f"Epoch {epoch:3d}/{args.epochs}  " + "  ".join(parts))
-
-        if epoch_losses["total"] < best_loss:
-            best_loss = epoch_losses["total"]
-            torch.save({
-                "model_state_dict": model.state_dict(),
-                "config": {
-                    "input_dim": EMBED_DIM,
-                    "num_axes": NUM_AXES,
-                    "subspace_dim": SUBSPACE_DIM,
-                    "axis_names": axis_names,
-                },
-            }, OUTPUT_WEIGHTS)
+                log["losses"][k].append(epoch_losses[k])
+
+            if epoch % 10 == 0 or epoch == 1:
+                parts = [f"L_{k}={epoch_losses[k]:.4f}" for k in axis_names if k in loaders]
+                parts.append(f"L_orth={epoch_losses['orthog']:.4f}")
+                parts.append(f"L_total={epoch_losses['total']:.4f}")
+                print(f"Epoch {epoch:3d}/{args.epochs}  " + "  ".join(parts))
+
+            if epoch_losses["total"] < best_loss:
+                best_loss = epoch_losses["total"]
+                best_state = copy.deepcopy(model.state_dict())
+
+            if epoch % CHECKPOINT_EVERY == 0:
+                flush_best()
+    finally:
+        flush_best()
 
     with open(OUTPUT_LOG, "w", encoding="utf-8") as f:
         json.dump(log, f, indent=2)
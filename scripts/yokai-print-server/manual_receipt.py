@@ -10,13 +10,14 @@ Usage:
     python manual_receipt.py photo.jpg --name "河童" --desc "川に棲む水妖。" --no-cut
 
 Requirements:
-    pip install python-escpos pillow pywin32
+    pip install python-escpos pillow numpy pywin32
 """
 
 import sys
 import argparse
 from pathlib import Path
 
+import numpy as np
 from PIL import Image
 
 # ──────────────────────────────────────────────
@@ -25,6 +26,19 @@ from PIL import Image
 DEFAULT_PRINTER = "EPSON TM-T90II Receipt"
 PRINTER_PROFILE = "TM-L90"
 PRINT_WIDTH_PX = 576  # 80mm paper at 180dpi
+RASTER_BAND_ROWS = 960  # max rows per GS v 0 command (same as python-escpos fragment_height)
+
+# 8x8 ordered-dither (Bayer) thresholds, scaled to 0-255
+BAYER8 = (np.array([
+    [ 0, 32,  8, 40,  2, 34, 10, 42],
+    [48, 16, 56, 24, 50, 18, 58, 26],
+    [12, 44,  4, 36, 14, 46,  6, 38],
+    [60, 28, 52, 20, 62, 30, 54, 22],
+    [ 3, 35, 11, 43,  1, 33,  9, 41],
+    [51, 19, 59, 27, 49, 17, 57, 25],
+    [15, 47,  7, 39, 13, 45,  5, 37],
+    [63, 31, 55, 23, 61, 29, 53, 21],
+]) * 4 + 2).astype(np.uint8)
 
 
 # ──────────────────────────────────────────────
@@ -58,19 +72,72 @@ def open_printer(printer_name):
 # ──────────────────────────────────────────────
 def prepare_image(img):
     """Resize to print width and convert to 1-bit for thermal output."""
+    # Large photos: let libjpeg decode at reduced scale, then a cheap bilinear
+    # pass down to 2x print width so LANCZOS only sees a small source.
+    if img.format == "JPEG":
+        img.draft("L", (PRINT_WIDTH_PX * 2, 1))
+    img.thumbnail((PRINT_WIDTH_PX * 2, 10**9), Image.BILINEAR)
+    if img.mode != "L":
+        img = img.convert("L")
     ratio = PRINT_WIDTH_PX / img.width
     new_h = int(img.height * ratio)
     img = img.resize((PRINT_WIDTH_PX, new_h), Image.LANCZOS)
-    img = img.convert("L").convert("1")
-    return img
+    return bayer_dither(img)
+
+
+def bayer_dither(img):
+    """Ordered-dither an L image to 1-bit with a tiled Bayer matrix (white where brighter)."""
+    arr = np.asarray(img)
+    h, w = arr.shape
+    thresh = np.tile(BAYER8, (h // 8 + 1, w // 8 + 1))[:h, :w]
+    return Image.fromarray(arr > thresh)  # bool array -> mode "1", no L intermediate
+
+
+def raster_bytes(img):
+    """Pack a 1-bit image into GS v 0 raster commands (black = 1)."""
+    bits = ~np.asarray(img, dtype=bool)
+    packed = np.packbits(bits, axis=1)
+    width_bytes = packed.shape[1]
+    out = bytearray()
+    for top in range(0, packed.shape[0], RASTER_BAND_ROWS):
+        band = packed[top:top + RASTER_BAND_ROWS]
+        xH, xL = divmod(width_bytes, 256)
+        yH, yL = divmod(band.shape[0], 256)
+        out += b"\x1d\x76\x30\x00" + bytes([xL, xH, yL, yH])
+        out += band.tobytes()
+    return bytes(out)
 
 
 # ──────────────────────────────────────────────
 # Text Output
 # ──────────────────────────────────────────────
-def _raw_text(p, text):
-    """Encode text as CP932 (Shift_JIS) and send to printer."""
-    p._raw(text.encode("cp932", errors="replace"))
+def _encode_text(text):
+    """Encode text as CP932 (Shift_JIS) for the printer's Kanji mode."""
+    return text.encode("cp932", errors="replace")
+
+
+# Static receipt sections, encoded once at import
+RULE_BYTES = _encode_text("━━━━━━━━━━━━━━━━━━\n")
+HEADER_BYTES = (
+    b"\x1b\x40"          # ESC @ — Initialize printer
+    b"\x1c\x26"          # FS & — Select Kanji character mode
+    b"\x1c\x43\x01"      # FS C 1 — Shift_JIS code system
+    b"\x1b\x61\x01"      # center
+    b"\x1b\x45\x01"      # bold ON
+    b"\x1d\x21\x11"      # double width+height
+    + _encode_text("BAKEBAKE_XR\n")
+    + b"\x1d\x21\x00"    # normal size
+    b"\x1b\x45\x00"      # bold OFF
+    + RULE_BYTES
+    + _encode_text("【 観測記録 】\n\n")
+)
+FOOTER_BYTES = (
+    b"\x1b\x61\x01"      # center
+    + RULE_BYTES
+    + _encode_text("この記録は感熱紙に印刷されています。\n")
+    + _encode_text("時間が経てば、この記憶も消えます。\n\n\n\n")
+)
+CUT_BYTES = b"\x1d\x56\x00"
 
 
 # ──────────────────────────────────────────────
@@ -80,6 +147,8 @@ def print_receipt(printer_name, image_path, name, desc, do_cut=True):
     """
     Print a receipt with the given photo, yokai name, and description.
     Uses the same layout as print_daemon.py.
+    The whole ESC/POS stream, image raster included, is accumulated
+    and sent in a single write.
     """
     # Load image
     print(f"[IMAGE] 読み込み中: {image_path}")
@@ -96,56 +165,41 @@ def print_receipt(printer_name, image_path, name, desc, do_cut=True):
     p = open_printer(printer_name)
 
     try:
-        # ESC @ — Initialize printer
-        p._raw(b"\x1b\x40")
-        # FS & — Select Kanji character mode
-        p._raw(b"\x1c\x26")
-        # FS C 1 — Shift_JIS code system
-        p._raw(b"\x1c\x43\x01")
-
-        # Header: center, bold, double size
-        p._raw(b"\x1b\x61\x01")  # center
-        p._raw(b"\x1b\x45\x01")  # bold ON
-        p._raw(b"\x1d\x21\x11")  # double width+height
-        _raw_text(p, "BAKEBAKE_XR\n")
-
-        # Normal size
-        p._raw(b"\x1d\x21\x00")
-        p._raw(b"\x1b\x45\x00")  # bold OFF
-        _raw_text(p, "━━━━━━━━━━━━━━━━━━\n")
-        _raw_text(p, "【 観測記録 】\n\n")
+        buf = bytearray()
+        emit = buf.extend
+
+        # Header: title, rule, section label
+        emit(HEADER_BYTES)
 
         # Image
-        p.image(img)
-        _raw_text(p, "\n")
+        emit(raster_bytes(img))
+        emit(b"\n")
         # Re-enable Kanji mode after image
-        p._raw(b"\x1c\x26")
-        p._raw(b"\x1c\x43\x01")
+        emit(b"\x1c\x26")
+        emit(b"\x1c\x43\x01")
 
         # Name: center, bold, double size
-        p._raw(b"\x1b\x61\x01")
-        p._raw(b"\x1b\x45\x01")
-        p._raw(b"\x1d\x21\x11")
-        _raw_text(p, f"{name}\n")
-        p._raw(b"\x1d\x21\x00")
-        p._raw(b"\x1b\x45\x00")
-        _raw_text(p, "\n")
+        emit(b"\x1b\x61\x01")
+        emit(b"\x1b\x45\x01")
+        emit(b"\x1d\x21\x11")
+        emit(_encode_text(f"{name}\n"))
+        emit(b"\x1d\x21\x00")
+        emit(b"\x1b\x45\x00")
+        emit(b"\n")
 
         # Description: left align
         if desc:
-            p._raw(b"\x1b\x61\x00")  # left align
-            _raw_text(p, f"{desc}\n\n")
+            emit(b"\x1b\x61\x00")  # left align
+            emit(_encode_text(f"{desc}\n\n"))
 
         # Footer: center
-        p._raw(b"\x1b\x61\x01")
-        _raw_text(p, "━━━━━━━━━━━━━━━━━━\n")
-        _raw_text(p, "この記録は感熱紙に印刷されています。\n")
-        _raw_text(p, "時間が経てば、この記憶も消えます。\n\n\n\n")
+        emit(FOOTER_BYTES)
 
         # Cut
         if do_cut:
-            p._raw(b"\x1d\x56\x00")
+            emit(CUT_BYTES)
 
+        p._raw(bytes(buf))
         p.close()
         print("[DONE] 印刷完了！")
 
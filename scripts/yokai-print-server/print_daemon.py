@@ -20,28 +20,54 @@ Usage:
     python print_daemon.py --printer "EPSON TM-T90II Receipt"
 
 Requirements:
-    pip install python-escpos pillow python-dotenv supabase pywin32 flask flask-cors
+    pip install python-escpos pillow numpy orjson pybase64 python-dotenv supabase pywin32 flask flask-cors waitress
+
+    Optional, faster image resize (drop-in Pillow replacement with SIMD kernels;
+    the startup banner shows which build is active):
+    pip uninstall pillow && CC="cc -mavx2" pip install -U --force-reinstall pillow-simd
 """
 
 import os
 import sys
+import atexit
 
 # Force unbuffered stdout so daemon thread prints are visible immediately
 sys.stdout.reconfigure(line_buffering=True)
 import json
+import functools
+import mmap
 import time
 import base64
+import hashlib
+import queue
+import struct
 import argparse
 import threading
+import urllib.parse
+import urllib.request
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
 from io import BytesIO
 from pathlib import Path
 
+import numpy as np
+import PIL
 from PIL import Image
 from dotenv import load_dotenv
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import pybase64 as b64  # SIMD base64 decoder, same API as the stdlib module
+except ImportError:
+    b64 = base64
+
 load_dotenv()
 
-# Supabase client for offline mode (mark printed=true after successful local print)
+# Shared Supabase client for both modes (one connection pool for the daemon's lifetime)
 _supabase_client = None
 def _get_supabase():
     global _supabase_client
@@ -53,6 +79,50 @@ def _get_supabase():
             print(f"[SUPABASE] Could not create client: {e}")
     return _supabase_client
 
+# Poll-only PostgREST client: one keep-alive (HTTP/2 when h2 is installed) TLS
+# session, so an empty poll is a single request on a warm connection
+_rest_client = None
+def _get_rest_client():
+    global _rest_client
+    if _rest_client is None and SUPABASE_URL and SUPABASE_KEY:
+        import httpx  # installed with supabase
+        try:
+            import h2  # noqa: F401
+            http2 = True
+        except ImportError:
+            http2 = False
+        _rest_client = httpx.Client(
+            http2=http2,
+            base_url=f"{SUPABASE_URL}/rest/v1",
+            headers={"apikey": SUPABASE_KEY, "Authorization": f"Bearer {SUPABASE_KEY}"},
+            limits=httpx.Limits(max_keepalive_connections=4),
+            timeout=15.0,
+        )
+    return _rest_client
+
+# "printed=true" updates run in the background so receipt latency never waits on Supabase
+_supabase_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="sb-update")
+
+def _mark_printed(record_ids, tag):
+    sb = _get_supabase()
+    if sb is None:
+        return
+    try:
+        # One PATCH for the whole batch
+        sb.table("surveys").update({"printed": True}).in_("id", record_ids).execute()
+        print(f"[{tag}] Marked {', '.join(map(str, record_ids))} as printed.")
+    except Exception as e:
+        print(f"[{tag}] DB update failed (print was OK): {e}")
+
+def mark_printed_async(record_ids, tag):
+    """
+    Mark survey rows (an id or a list of ids) as printed without blocking the
+    caller. Returns the Future of the update.
+    """
+    if not isinstance(record_ids, (list, tuple)):
+        record_ids = [record_ids]
+    return _supabase_pool.submit(_mark_printed, list(record_ids), tag)
+
 # ──────────────────────────────────────────────
 # Configuration
 # ──────────────────────────────────────────────
@@ -60,8 +130,26 @@ SUPABASE_URL = os.environ.get("SUPABASE_URL")
 SUPABASE_KEY = os.environ.get("SUPABASE_KEY")
 PRINTER_NAME = os.environ.get("PRINTER_NAME", "EPSON TM-T90II Receipt")
 PRINT_WIDTH_PX = 576        # 80mm paper at 180dpi
-POLL_INTERVAL = 10           # seconds
+RASTER_BAND_ROWS = 960      # max rows per GS v 0 command (same as python-escpos fragment_height)
+WRITE_CHUNK_BYTES = 4096    # per WritePrinter call; TM-T90II receive buffer is 4 KB
+POLL_INTERVAL = 60           # seconds; safety net only, Realtime drives prints
+POLL_BATCH = 50              # max records per poll (get_pending_prints has the same LIMIT)
 LOCAL_PORT = 5555            # HTTP API port for offline mode
+IMAGE_FETCH_TIMEOUT = 15     # seconds, for yokai_image_url downloads
+IMAGE_FORMATS = ["JPEG", "PNG", "WEBP"]  # only decoders Image.open will probe
+RESAMPLE = Image.LANCZOS     # downscale filter (upscales use NEAREST)
+
+# 8x8 ordered-dither thresholds (0-255), same matrix as manual_receipt.py
+BAYER8 = (np.array([
+    [ 0, 32,  8, 40,  2, 34, 10, 42],
+    [48, 16, 56, 24, 50, 18, 58, 26],
+    [12, 44,  4, 36, 14, 46,  6, 38],
+    [60, 28, 52, 20, 62, 30, 54, 22],
+    [ 3, 35, 11, 43,  1, 33,  9, 41],
+    [51, 19, 59, 27, 49, 17, 57, 25],
+    [15, 47,  7, 39, 13, 45,  5, 37],
+    [63, 31, 55, 23, 61, 29, 53, 21],
+]) * 4 + 2).astype(np.uint8)
 
 
 # ──────────────────────────────────────────────
@@ -100,189 +188,711 @@ def open_printer():
         from escpos.printer import Dummy
         return Dummy()
 
+
+class SpoolPrinter:
+    """
+    Long-lived Windows spooler handle.
+    Each receipt is still its own RAW document (StartDocPrinter ... EndDocPrinter
+    flushes it to the printer), but OpenPrinter/ClosePrinter happen only once.
+    """
+
+    def __init__(self, name):
+        import win32print
+        self._win32print = win32print
+        self.handle = win32print.OpenPrinter(name)
+
+    def start_doc(self, title="Yokai"):
+        self._win32print.StartDocPrinter(self.handle, 1, (title, None, "RAW"))
+        self._win32print.StartPagePrinter(self.handle)
+
+    def _raw(self, data):
+        # Feed the spooler in printer-buffer-sized pieces; WritePrinter may
+        # also accept fewer bytes than offered, so resume from what it took
+        view = memoryview(data)
+        while view:
+            written = self._win32print.WritePrinter(self.handle, bytes(view[:WRITE_CHUNK_BYTES]))
+            if written <= 0:
+                raise OSError("WritePrinter accepted no data")
+            view = view[written:]
+
+    def end_doc(self):
+        self._win32print.EndPagePrinter(self.handle)
+        self._win32print.EndDocPrinter(self.handle)
+
+    def close(self):
+        self._win32print.ClosePrinter(self.handle)
+
+
+class NullPrinter:
+    """Stand-in when pywin32 is not installed: accepts and discards output."""
+
+    def start_doc(self, title="Yokai"):
+        pass
+
+    def _raw(self, data):
+        pass
+
+    def end_doc(self):
+        pass
+
+    def close(self):
+        pass
+
+
+_printer = None  # owned by the printer thread; opened lazily, closed when idle or after a spooler error
+
+def _get_printer():
+    global _printer
+    if _printer is None:
+        try:
+            _printer = SpoolPrinter(PRINTER_NAME)
+        except ImportError:
+            print("[PRINTER] win32print not available. Using Dummy printer.")
+            _printer = NullPrinter()
+    return _printer
+
+def _close_printer():
+    global _printer
+    if _printer is not None:
+        try:
+            _printer.close()
+        except Exception:
+            pass
+        _printer = None
+
+atexit.register(_close_printer)
+
 # Verify printer is accessible on startup
 _test_printer = open_printer()
 print(f"[PRINTER] Verified: {PRINTER_NAME} (profile={PRINTER_PROFILE})")
 _test_printer.close()
 del _test_printer
 
-# Thread lock so two modes don't print at the same time.
-print_lock = threading.Lock()
-
 # ──────────────────────────────────────────────
 # Persistent Print Queue
 # ──────────────────────────────────────────────
-QUEUE_FILE = Path(__file__).parent / "print_queue.json"
+# Append-only log + index (Bitcask-style):
+#   print_queue.log — length-prefixed JSON job records, never rewritten in place
+#   print_queue.idx — fixed-size (offset, length, status, retries) entries;
+#                     the last entry for an offset is its current state
+# Enqueue is a single append to each file instead of a full JSON rewrite.
+QUEUE_DIR = Path(__file__).parent
+QUEUE_LOG = QUEUE_DIR / "print_queue.log"
+QUEUE_IDX = QUEUE_DIR / "print_queue.idx"
+LEGACY_QUEUE_FILE = QUEUE_DIR / "print_queue.json"
 MAX_PRINT_RETRIES = 3
-_recent_jobs: list = []  # last N completed job IDs for /status
+COMPACT_MIN_BYTES = 8 * 1024 * 1024  # only rewrite the log once it has this much dead data
+ENQUEUE_MAX_BATCH = 32   # jobs per group commit
+ENQUEUE_FLUSH_MS = 20    # max wait for more jobs before committing a batch
+# Enqueued jobs per fsync of the log/index (1 = fsync every batch). Unsynced jobs
+# are also flushed after QUEUE_CHECKPOINT_SECONDS, bounding the loss window.
+QUEUE_CHECKPOINT_WRITES = int(os.environ.get("QUEUE_CHECKPOINT_WRITES", "16"))
+QUEUE_CHECKPOINT_SECONDS = 1.0
+
+STATUS_PENDING = 0
+STATUS_ACKED = 1
+STATUS_DISCARDED = 2
+_LEN_PREFIX = struct.Struct("<I")
+_IDX_ENTRY = struct.Struct("<QIBB")  # offset, length, status, retries
+
+_queue_lock = threading.Lock()
+_pending: dict = {}  # log offset -> (length, retries)
+_enqueue_ch: queue.Queue = queue.Queue()  # (payload, Future) for the writer thread
+_recent_jobs: deque = deque(maxlen=20)  # last N completed job IDs for /status
+
+
+def _json_dumps(obj) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False).encode("utf-8")
+
+
+def _json_loads(data):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def _fsync_append(path: Path, data: bytes, sync: bool = True) -> int:
+    """Append bytes to a file (fsync unless sync=False) and return the offset they were written at."""
+    with open(path, "ab") as f:
+        offset = f.seek(0, os.SEEK_END)
+        f.write(data)
+        f.flush()
+        if sync:
+            os.fsync(f.fileno())
+    return offset
+
+
+def _sync_queue_files():
+    """fsync the log and index. Caller holds _queue_lock."""
+    for path in (QUEUE_LOG, QUEUE_IDX):
+        if path.exists():
+            with open(path, "ab") as f:
+                os.fsync(f.fileno())
+
+
+def _iter_jobs(batch: list):
+    """
+    Yield (offset, length, retries, job) for each (offset, (length, retries)) in
+    `batch`, reading through one read-only mmap of the log. Only one decoded job
+    is resident at a time; job is None for an unreadable record.
+    """
+    if not QUEUE_LOG.exists() or QUEUE_LOG.stat().st_size == 0:
+        return
+    with open(QUEUE_LOG, "rb") as f:
+        if hasattr(os, "posix_fadvise"):
+            # Jobs are read in log order: ask the kernel for larger readahead
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for offset, (length, retries) in batch:
+                start = offset + _LEN_PREFIX.size
+                try:
+                    job = _json_loads(mm[start:start + length])
+                except Exception as e:
+                    print(f"[QUEUE] Unreadable record at {offset}: {e}")
+                    job = None
+                yield offset, length, retries, job
+
+
+def _recover_queue():
+    """Finish an interrupted compaction, then rebuild the pending set from the index."""
+    log_tmp = QUEUE_LOG.with_suffix(".log.tmp")
+    idx_tmp = QUEUE_IDX.with_suffix(".idx.tmp")
+    if log_tmp.exists():
+        # Crashed before the log was swapped in: old files are still consistent
+        log_tmp.unlink()
+        idx_tmp.unlink(missing_ok=True)
+    elif idx_tmp.exists():
+        # Crashed between the two renames: the new log is live, finish the index
+        os.replace(idx_tmp, QUEUE_IDX)
+
+    _pending.clear()
+    if QUEUE_IDX.exists():
+        raw = QUEUE_IDX.read_bytes()
+        usable = len(raw) - len(raw) % _IDX_ENTRY.size  # drop a torn trailing entry
+        for offset, length, status, retries in _IDX_ENTRY.iter_unpack(raw[:usable]):
+            if status == STATUS_PENDING:
+                _pending[offset] = (length, retries)
+            else:
+                _pending.pop(offset, None)
+
+
+def _compact_queue():
+    """Drop acknowledged records from the log. Caller holds _queue_lock."""
+    if not QUEUE_LOG.exists():
+        return
+    if not _pending:
+        # Nothing live: truncate the index first so it never points past the log
+        QUEUE_IDX.write_bytes(b"")
+        QUEUE_LOG.write_bytes(b"")
+        return
+    live_bytes = sum(length + _LEN_PREFIX.size for length, _ in _pending.values())
+    dead_bytes = QUEUE_LOG.stat().st_size - live_bytes
+    if dead_bytes == 0 or dead_bytes < COMPACT_MIN_BYTES:
+        return
+
+    log_tmp = QUEUE_LOG.with_suffix(".log.tmp")
+    idx_tmp = QUEUE_IDX.with_suffix(".idx.tmp")
+    new_pending = {}
+    with open(QUEUE_LOG, "rb") as src, open(log_tmp, "wb") as dst, open(idx_tmp, "wb") as idx:
+        for offset in sorted(_pending):
+            length, retries = _pending[offset]
+            src.seek(offset)
+            new_offset = dst.tell()
+            dst.write(src.read(_LEN_PREFIX.size + length))
+            idx.write(_IDX_ENTRY.pack(new_offset, length, STATUS_PENDING, retries))
+            new_pending[new_offset] = (length, retries)
+        for f in (dst, idx):
+            f.flush()
+            os.fsync(f.fileno())
+    os.replace(log_tmp, QUEUE_LOG)
+    os.replace(idx_tmp, QUEUE_IDX)
+    _pending.clear()
+    _pending.update(new_pending)
+    print(f"[QUEUE] Compacted log ({dead_bytes} bytes reclaimed)")
+
+
+def pending_count() -> int:
+    return len(_pending)
+
+
+def _commit_batch(payloads: list, sync: bool):
+    """Append a batch of job payloads with one write per file. Caller holds _queue_lock."""
+    with open(QUEUE_LOG, "ab") as f:
+        offset = f.seek(0, os.SEEK_END)
+        records = bytearray()
+        entries = []
+        for payload in payloads:
+            entries.append((offset + len(records), len(payload)))
+            records += _LEN_PREFIX.pack(len(payload)) + payload
+        f.write(records)
+        f.flush()
+        if sync:
+            os.fsync(f.fileno())
+    _fsync_append(QUEUE_IDX, b"".join(
+        _IDX_ENTRY.pack(off, length, STATUS_PENDING, 0) for off, length in entries), sync)
+    for off, length in entries:
+        _pending[off] = (length, 0)
+
+
+def _queue_writer():
+    """
+    Group commit: drain up to ENQUEUE_MAX_BATCH jobs (or ENQUEUE_FLUSH_MS) and
+    append them at once. fsync every QUEUE_CHECKPOINT_WRITES jobs or
+    QUEUE_CHECKPOINT_SECONDS, whichever comes first.
+    """
+    unsynced = 0
+    last_sync = time.monotonic()
+    while True:
+        try:
+            batch = [_enqueue_ch.get(timeout=QUEUE_CHECKPOINT_SECONDS if unsynced else None)]
+        except queue.Empty:
+            # Idle with unsynced jobs: checkpoint now
+            with _queue_lock:
+                try:
+                    _sync_queue_files()
+                except Exception as e:
+                    print(f"[QUEUE] Error syncing queue: {e}")
+            unsynced = 0
+            last_sync = time.monotonic()
+            continue
+
+        deadline = time.monotonic() + ENQUEUE_FLUSH_MS / 1000
+        while len(batch) < ENQUEUE_MAX_BATCH:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(_enqueue_ch.get(timeout=timeout))
+            except queue.Empty:
+                break
+
+        unsynced += len(batch)
+        sync = (unsynced >= QUEUE_CHECKPOINT_WRITES
+                or time.monotonic() - last_sync >= QUEUE_CHECKPOINT_SECONDS)
+        error = None
+        with _queue_lock:
+            try:
+                _commit_batch([payload for payload, _ in batch], sync)
+                print(f"[QUEUE] Enqueued {len(batch)} job(s) (queue size: {len(_pending)})")
+            except Exception as e:
+                print(f"[QUEUE] Error saving queue: {e}")
+                error = e
+        if sync:
+            unsynced = 0
+            last_sync = time.monotonic()
+        for _, done in batch:
+            if error is None:
+                done.set_result(True)
+            else:
+                done.set_exception(error)
+
+
+def enqueue_job(data: dict) -> Future:
+    """
+    Hand a print job to the queue writer without blocking. The returned Future
+    resolves to True once the job is in the log (fsynced per
+    QUEUE_CHECKPOINT_WRITES), or raises the error if the write failed.
+    """
+    payload = _json_dumps(data)
+    done = Future()
+    _enqueue_ch.put((payload, done))
+    return done
+
 
-def _load_queue() -> list:
-    """Load pending print queue from disk."""
+def _migrate_legacy_queue():
+    """Move jobs from the old whole-file print_queue.json into the log."""
+    if not LEGACY_QUEUE_FILE.exists():
+        return
     try:
-        if QUEUE_FILE.exists():
-            return json.loads(QUEUE_FILE.read_text(encoding="utf-8"))
+        jobs = _json_loads(LEGACY_QUEUE_FILE.read_bytes())
     except Exception as e:
-        print(f"[QUEUE] Error loading queue: {e}")
-    return []
-
-def _save_queue(queue: list):
-    """Persist pending queue to disk."""
+        print(f"[QUEUE] Error loading legacy queue: {e}")
+        return
     try:
-        QUEUE_FILE.write_text(json.dumps(queue, ensure_ascii=False), encoding="utf-8")
+        for done in [enqueue_job(job) for job in jobs]:
+            done.result()
+        with _queue_lock:
+            _sync_queue_files()
     except Exception as e:
-        print(f"[QUEUE] Error saving queue: {e}")
+        # Keep the legacy file: it is the only complete copy of these jobs
+        print(f"[QUEUE] Error migrating legacy queue (kept {LEGACY_QUEUE_FILE.name}): {e}")
+        return
+    LEGACY_QUEUE_FILE.unlink()
+    print(f"[QUEUE] Migrated {len(jobs)} job(s) from {LEGACY_QUEUE_FILE.name}")
 
-def enqueue_job(data: dict):
-    """Add a print job to the persistent queue."""
-    queue = _load_queue()
-    queue.append(data)
-    _save_queue(queue)
-    print(f"[QUEUE] Enqueued job (queue size: {len(queue)})")
 
-def process_queue():
-    """Process all pending jobs in the queue."""
-    queue = _load_queue()
-    if not queue:
-        return
-    print(f"[QUEUE] Processing {len(queue)} pending job(s)...")
-    remaining = []
-    for job in queue:
-        success = print_yokai(job)
-        if not success:
-            retries = job.get("_retries", 0)
-            if retries < MAX_PRINT_RETRIES:
-                job["_retries"] = retries + 1
-                remaining.append(job)
+def _settle_jobs(window: list):
+    """
+    Wait for a window of submitted queue jobs and record every outcome with
+    one index append. Caller does not hold _queue_lock.
+    """
+    results = [(offset, length, retries, job, done.result() if done else False)
+               for offset, length, retries, job, done in window]
+    printed_ids = [job["id"] for _, _, _, job, success in results if success and job.get("id")]
+    if printed_ids:
+        mark_printed_async(printed_ids, "QUEUE")
+    entries = bytearray()
+    with _queue_lock:
+        for offset, length, retries, job, success in results:
+            if success:
+                entries += _IDX_ENTRY.pack(offset, length, STATUS_ACKED, retries)
+                _pending.pop(offset, None)
+            elif job and retries < MAX_PRINT_RETRIES:
+                entries += _IDX_ENTRY.pack(offset, length, STATUS_PENDING, retries + 1)
+                _pending[offset] = (length, retries + 1)
                 print(f"[QUEUE] Job {job.get('id', '?')} failed, retry {retries+1}/{MAX_PRINT_RETRIES}")
             else:
-                print(f"[QUEUE] Job {job.get('id', '?')} failed after {MAX_PRINT_RETRIES} retries, discarding.")
-    _save_queue(remaining)
+                entries += _IDX_ENTRY.pack(offset, length, STATUS_DISCARDED, retries)
+                _pending.pop(offset, None)
+                print(f"[QUEUE] Job {(job or {}).get('id', '?')} failed after {MAX_PRINT_RETRIES} retries, discarding.")
+        _fsync_append(QUEUE_IDX, bytes(entries))
+
+
+def process_queue():
+    """
+    Process all pending jobs in the queue.
+    Jobs go to the printer MAX_COALESCE at a time, so they share a spooler
+    document and their outcomes share one index write; a crash mid-window
+    can at worst reprint that window.
+    """
+    with _queue_lock:
+        batch = sorted(_pending.items())
+    if not batch:
+        return
+    print(f"[QUEUE] Processing {len(batch)} pending job(s)...")
+    window = []
+    for offset, length, retries, job in _iter_jobs(batch):
+        # Unreadable record: no future, settled as discarded
+        # The queue only holds jobs posted to the local HTTP API, so file:// is allowed
+        window.append((offset, length, retries, job,
+                       submit_print(job, allow_file=True) if job is not None else None))
+        if len(window) >= MAX_COALESCE:
+            _settle_jobs(window)
+            window = []
+    if window:
+        _settle_jobs(window)
+
+    with _queue_lock:
+        _compact_queue()
+
+
+QUEUE_RETRY_INTERVAL = 300  # seconds between background retries of the queue while running
+_queue_drain_wake = threading.Event()  # set to retry now (a fresh print just succeeded)
+_queue_drain_lock = threading.Lock()
 
-# Process any jobs left from a previous crash on startup
-process_queue()
+
+def _queue_drainer():
+    """
+    Retry queued jobs while the daemon runs, not only at startup: right after
+    a fresh print succeeds, or every QUEUE_RETRY_INTERVAL otherwise.
+    """
+    while True:
+        _queue_drain_wake.wait(timeout=QUEUE_RETRY_INTERVAL)
+        _queue_drain_wake.clear()
+        if not pending_count():
+            continue
+        with _queue_drain_lock:
+            try:
+                process_queue()
+            except Exception as e:
+                print(f"[QUEUE] Retry drain failed: {e}")
+
+
+_recover_queue()
+threading.Thread(target=_queue_writer, name="queue-writer", daemon=True).start()
 
 
 # ──────────────────────────────────────────────
 # Image Processing
 # ──────────────────────────────────────────────
 def prepare_image(img):
-    """Resize to print width and convert to 1-bit for thermal output."""
-    ratio = PRINT_WIDTH_PX / img.width
-    new_h = int(img.height * ratio)
-    img = img.resize((PRINT_WIDTH_PX, new_h), Image.LANCZOS)
-    img = img.convert("L").convert("1")
-    return img
+    """
+    Resize to print width and convert to 1-bit for thermal output.
+    Clients that upload images already PRINT_WIDTH_PX wide skip the resize.
+    """
+    if img.mode != "L":
+        img = img.convert("L")  # resize one channel instead of three
+    # Box-reduce huge PNG/WEBP uploads (JPEG is already cut by draft()) to
+    # within 2x of print width so the final filter runs on far fewer pixels
+    factor = img.width // (PRINT_WIDTH_PX * 2)
+    if factor > 1:
+        img = img.reduce(factor)
+    if img.width != PRINT_WIDTH_PX:
+        ratio = PRINT_WIDTH_PX / img.width
+        # Multiple of 8 rows so the raster command needs no padding
+        new_h = max(8, round(img.height * ratio / 8) * 8)
+        # Upscaling: the 1-bit dither hides any difference, so use the cheapest filter
+        resample = RESAMPLE if img.width > PRINT_WIDTH_PX else Image.NEAREST
+        img = img.resize((PRINT_WIDTH_PX, new_h), resample)
+    return bayer_dither(img)
+
+
+def bayer_dither(img):
+    """Ordered-dither an L image to 1-bit with a tiled Bayer matrix (white where brighter)."""
+    arr = np.asarray(img)
+    h, w = arr.shape
+    thresh = np.tile(BAYER8, (h // 8 + 1, w // 8 + 1))[:h, :w]
+    return Image.fromarray(arr > thresh)  # bool array -> mode "1", no L intermediate
+
+
+def raster_bytes(img):
+    """Pack a 1-bit image into GS v 0 raster commands (black = 1)."""
+    bits = ~np.asarray(img, dtype=bool)
+    packed = np.packbits(bits, axis=1)
+    width_bytes = packed.shape[1]
+    out = bytearray()
+    for top in range(0, packed.shape[0], RASTER_BAND_ROWS):
+        band = packed[top:top + RASTER_BAND_ROWS]
+        xH, xL = divmod(width_bytes, 256)
+        yH, yL = divmod(band.shape[0], 256)
+        out += b"\x1d\x76\x30\x00" + bytes([xL, xH, yL, yH])
+        out += band.data  # contiguous row slice: no intermediate bytes copy
+    return bytes(out)
 
 
 def decode_image(image_b64):
-    """Decode a base64-encoded image string into a PIL Image."""
-    if "," in image_b64:
-        image_b64 = image_b64.split(",")[1]
-    return Image.open(BytesIO(base64.b64decode(image_b64)))
+    """
+    Decode a base64 image (str or bytes, optionally a data: URL) into a PIL Image.
+    Only the header is scanned for the comma; the payload is sliced once.
+    """
+    comma = b"," if isinstance(image_b64, (bytes, bytearray)) else ","
+    idx = image_b64.find(comma, 0, 128)  # "data:image/...;base64," prefix is short
+    payload = image_b64[idx + 1:] if idx >= 0 else image_b64
+    img = Image.open(BytesIO(b64.b64decode(payload, validate=False)), formats=IMAGE_FORMATS)
+    # JPEG only: let libjpeg decode grayscale at a reduced scale (>= 2x print width).
+    # Height 1: draft keeps both sides >= the request, and only the width matters here
+    img.draft("L", (PRINT_WIDTH_PX * 2, 1))
+    img.load()  # decode now so the encoded bytes can be freed
+    return img
+
+
+def fetch_image(url, allow_file=False):
+    """
+    Open an image from an http(s) URL (e.g. Supabase Storage), or a file://
+    path when allow_file (jobs posted to the local HTTP API only).
+    """
+    scheme = urllib.parse.urlparse(url).scheme.lower()
+    if scheme == "file" and allow_file:
+        # Local file: let PIL read it directly instead of buffering it all in memory
+        path = urllib.request.url2pathname(urllib.parse.urlparse(url).path)
+        img = Image.open(path, formats=IMAGE_FORMATS)
+    elif scheme in ("http", "https"):
+        with urllib.request.urlopen(url, timeout=IMAGE_FETCH_TIMEOUT) as resp:
+            img = Image.open(BytesIO(resp.read()), formats=IMAGE_FORMATS)
+    else:
+        raise ValueError(f"Unsupported image URL scheme: {scheme or url!r}")
+    img.draft("L", (PRINT_WIDTH_PX * 2, 1))
+    img.load()
+    return img
 
 
 # ──────────────────────────────────────────────
 # Print Function
 # ──────────────────────────────────────────────
-def _raw_text(p, text):
-    """Encode text as CP932 (Shift_JIS) and send to printer."""
-    p._raw(text.encode("cp932", errors="replace"))
-
-
-def print_yokai(data):
+@functools.lru_cache(maxsize=512)  # names/descriptions repeat across retries and batches
+def _encode_text(text):
+    """Encode text as CP932 (Shift_JIS) for the printer's Kanji mode."""
+    return text.encode("cp932", errors="replace")
+
+
+# Static receipt sections, built once at import (byte-identical for every job)
+KANJI_MODE_BYTES = (
+    b"\x1c\x26"          # FS & — Select Kanji character mode
+    b"\x1c\x43\x01"      # FS C 1 — Shift_JIS code system
+)
+HEADER_BYTES = (
+    b"\x1b\x40"          # ESC @ — Initialize printer
+    + KANJI_MODE_BYTES
+    + b"\x1b\x61\x01"    # center
+    b"\x1b\x45\x01"      # bold ON
+    b"\x1d\x21\x11"      # double width+height
+    + "BAKEBAKE_XR\n".encode("cp932")
+    + b"\x1d\x21\x00"    # normal size
+    b"\x1b\x45\x00"      # bold OFF
+    + "━━━━━━━━━━━━━━━━━━\n【 観測記録 】\n\n".encode("cp932")
+)
+NAME_START_BYTES = (
+    b"\x1b\x61\x01"      # center
+    b"\x1b\x45\x01"      # bold ON
+    b"\x1d\x21\x11"      # double width+height
+)
+NAME_END_BYTES = (
+    b"\x1d\x21\x00"      # normal size
+    b"\x1b\x45\x00"      # bold OFF
+    b"\n"
+)
+DESC_START_BYTES = b"\x1b\x61\x00"  # left align
+FOOTER_BYTES = (
+    b"\x1b\x61\x01"      # center
+    + "━━━━━━━━━━━━━━━━━━\n".encode("cp932")
+    + "この記録は感熱紙に印刷されています。\n".encode("cp932")
+    + "時間が経てば、この記憶も消えます。\n\n\n\n".encode("cp932")
+)
+CUT_BYTES = b"\x1d\x56\x00"  # GS V 0 — full cut
+RECEIPT_TAIL_BYTES = FOOTER_BYTES + CUT_BYTES
+
+
+RASTER_CACHE_SIZE = 64  # distinct images kept as ready-to-send raster bytes
+_raster_cache: "OrderedDict[bytes, bytes]" = OrderedDict()
+_raster_cache_lock = threading.Lock()  # build_receipt runs on the prepare pool
+
+
+def _image_raster(image_url, image_b64, allow_file=False):
     """
-    Print a yokai receipt.
-    `data` is a dict with keys: yokai_name, yokai_desc, yokai_image_b64 (optional).
-    Thread-safe via print_lock.
-    Opens a fresh printer connection per job and closes it after,
-    which triggers EndDocPrinter/EndPagePrinter to flush the Windows spooler.
+    GS v 0 raster bytes for a job's image. Inline base64 images go through an
+    LRU keyed by a hash of their content, so retries and repeats skip
+    decode/resize/dither. URL images are always fetched: the object behind a
+    URL (a reused file:// path, an overwritten Storage key) can change.
+    """
+    if image_url:
+        return raster_bytes(prepare_image(fetch_image(image_url, allow_file)))
+
+    key = hashlib.blake2b(image_b64.encode() if isinstance(image_b64, str) else image_b64,
+                          digest_size=16).digest()
+    with _raster_cache_lock:
+        raster = _raster_cache.get(key)
+        if raster is not None:
+            _raster_cache.move_to_end(key)
+            return raster
+
+    raster = raster_bytes(prepare_image(decode_image(image_b64)))
+    with _raster_cache_lock:
+        _raster_cache[key] = raster
+        if len(_raster_cache) > RASTER_CACHE_SIZE:
+            _raster_cache.popitem(last=False)
+    return raster
+
+
+def build_receipt(data, allow_file=False):
+    """
+    Build the complete ESC/POS byte stream for one yokai receipt.
+    `data` is a dict with keys: yokai_name, yokai_desc, and optionally
+    yokai_image_url (preferred) or yokai_image_b64.
+    A yokai_image_url that cannot be fetched raises, so the job fails and is
+    retried instead of printing without its photo; undecodable inline base64
+    is skipped. Pure CPU work otherwise; safe to run on any thread.
     """
     name = data.get("yokai_name", "名無しの妖")
     desc = data.get("yokai_desc", "")
+    image_url = data.get("yokai_image_url")
     image_b64 = data.get("yokai_image_b64")
-    record_id = data.get("id", "local")
 
-    with print_lock:
-        print(f"[PRINT] Job {record_id}: {name}")
-        p = None
+    buf = bytearray(HEADER_BYTES)
+
+    # Image
+    raster = None
+    if image_url:
+        raster = _image_raster(image_url, None, allow_file)
+    elif image_b64:
         try:
-            p = open_printer()
-
-            # ESC @ — Initialize printer
-            p._raw(b"\x1b\x40")
-            # FS & — Select Kanji character mode
-            p._raw(b"\x1c\x26")
-            # FS C 1 — Shift_JIS code system
-            p._raw(b"\x1c\x43\x01")
-
-            # Header: center, bold, double size
-            p._raw(b"\x1b\x61\x01")  # center
-            p._raw(b"\x1b\x45\x01")  # bold ON
-            p._raw(b"\x1d\x21\x11")  # double width+height
-            _raw_text(p, "BAKEBAKE_XR\n")
-
-            # Normal size
-            p._raw(b"\x1d\x21\x00")
-            p._raw(b"\x1b\x45\x00")  # bold OFF
-            _raw_text(p, "━━━━━━━━━━━━━━━━━━\n")
-            _raw_text(p, "【 観測記録 】\n\n")
-
-            # Image
-            if image_b64:
-                try:
-                    img = decode_image(image_b64)
-                    img = prepare_image(img)
-                    p.image(img)
-                    _raw_text(p, "\n")
-                    # Re-enable Kanji mode after image (image command may reset)
-                    p._raw(b"\x1c\x26")
-                    p._raw(b"\x1c\x43\x01")
-                except Exception as img_err:
-                    print(f"[PRINT] Image error (skipping): {img_err}")
-
-            # Name: center, bold, double size
-            p._raw(b"\x1b\x61\x01")
-            p._raw(b"\x1b\x45\x01")
-            p._raw(b"\x1d\x21\x11")
-            _raw_text(p, f"{name}\n")
-            p._raw(b"\x1d\x21\x00")
-            p._raw(b"\x1b\x45\x00")
-            _raw_text(p, "\n")
-
-            # Description: left align
-            if desc:
-                p._raw(b"\x1b\x61\x00")  # left align
-                _raw_text(p, f"{desc}\n\n")
-
-            # Footer: center
-            p._raw(b"\x1b\x61\x01")
-            _raw_text(p, "━━━━━━━━━━━━━━━━━━\n")
-            _raw_text(p, "この記録は感熱紙に印刷されています。\n")
-            _raw_text(p, "時間が経てば、この記憶も消えます。\n\n\n\n")
-
-            # Cut
-            p._raw(b"\x1d\x56\x00")
-
-            # Close triggers EndDocPrinter → flush to physical printer
-            p.close()
-            p = None
-
-            print(f"[PRINT] Done: {record_id}")
-            _recent_jobs.append({"id": record_id, "name": name, "time": time.strftime("%H:%M:%S")})
-            if len(_recent_jobs) > 20:
-                _recent_jobs.pop(0)
-            return True
+            raster = _image_raster(None, image_b64)
+        except Exception as img_err:
+            print(f"[PRINT] Image error (skipping): {img_err}")
+    if raster is not None:
+        buf += raster
+        buf += b"\n"
+        # Re-enable Kanji mode after image (image command may reset)
+        buf += KANJI_MODE_BYTES
+
+    # Name: center, bold, double size
+    buf += NAME_START_BYTES + _encode_text(f"{name}\n") + NAME_END_BYTES
+
+    # Description: left align
+    if desc:
+        buf += DESC_START_BYTES + _encode_text(f"{desc}\n\n")
+
+    # Footer: center, then cut
+    buf += RECEIPT_TAIL_BYTES
+    return bytes(buf)
+
+
+# Receipts are built on a small pool (CPU) and written by one printer thread
+# (I/O), so image work for the next job overlaps the spooler flush of this one.
+PREPARE_WORKERS = 4
+PRINTER_IDLE_CLOSE = 30.0  # seconds without work before the printer thread releases the handle
+MAX_COALESCE = 5  # receipts merged into one spooler document when they queue up
+_prepare_pool = ThreadPoolExecutor(max_workers=PREPARE_WORKERS, thread_name_prefix="prepare")
+_print_jobs: queue.Queue = queue.Queue()  # (data, Future[bytes], Future[bool]), in submission order
 
+
+def _write_document(title, blob):
+    """
+    Send receipts as one RAW document over the long-lived spooler handle.
+    EndDocPrinter flushes it to the physical printer. On a spooler error the
+    handle is reopened and the document retried once. Printer thread only.
+    """
+    for attempt in range(2):
+        try:
+            p = _get_printer()
+            p.start_doc(title)
+            p._raw(blob)
+            p.end_doc()
+            return True
         except Exception as e:
-            print(f"[PRINT] Error: {e}")
-            return False
-        finally:
-            # Ensure printer is closed even on error
-            if p is not None:
-                try:
-                    p.close()
-                except Exception:
-                    pass
+            _close_printer()
+            if attempt == 0:
+                print(f"[PRINT] Printer error, reopening: {e}")
+            else:
+                print(f"[PRINT] Error: {e}")
+    return False
+
+
+def _printer_worker():
+    """
+    Single writer: prints prepared receipts in submission order.
+    The only thread that touches the printer handle, so no lock is needed;
+    the handle stays open across bursts and is closed after PRINTER_IDLE_CLOSE.
+    Receipts already waiting when the printer frees up (up to MAX_COALESCE)
+    go out as one spooler document; each blob ends in its own cut.
+    """
+    while True:
+        try:
+            jobs = [_print_jobs.get(timeout=PRINTER_IDLE_CLOSE if _printer is not None else None)]
+        except queue.Empty:
+            _close_printer()
+            continue
+        while len(jobs) < MAX_COALESCE:
+            try:
+                jobs.append(_print_jobs.get_nowait())
+            except queue.Empty:
+                break
+
+        ready = []
+        for data, prepared, done in jobs:
+            try:
+                ready.append((data, prepared.result(), done))
+            except Exception as e:
+                print(f"[PRINT] Error: {e}")
+                done.set_result(False)
+        if not ready:
+            continue
+
+        ids = [data.get("id", "local") for data, _, _ in ready]
+        success = _write_document(f"Yokai {', '.join(map(str, ids))}",
+                                  b"".join(blob for _, blob, _ in ready))
+        for data, _, done in ready:
+            if success:
+                print(f"[PRINT] Done: {data.get('id', 'local')}")
+                _recent_jobs.append({"id": data.get("id", "local"),
+                                     "name": data.get("yokai_name", "名無しの妖"),
+                                     "time": time.strftime("%H:%M:%S")})
+            done.set_result(success)
+
+
+def submit_print(data, allow_file=False):
+    """
+    Queue a receipt for printing; returns a Future resolving to True on success.
+    allow_file permits file:// image URLs (local HTTP API jobs only).
+    """
+    print(f"[PRINT] Job {data.get('id', 'local')}: {data.get('yokai_name', '名無しの妖')}")
+    done = Future()
+    _print_jobs.put((data, _prepare_pool.submit(build_receipt, data, allow_file), done))
+    return done
+
+
+threading.Thread(target=_printer_worker, name="printer", daemon=True).start()
 
 
 # ──────────────────────────────────────────────
@@ -294,8 +904,11 @@ def start_online_mode():
         print("[ONLINE] SUPABASE_URL / SUPABASE_KEY not set. Skipping online mode.")
         return
 
-    from supabase import create_client
-    supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+    supabase = _get_supabase()
+    if supabase is None:
+        return
+
+    threading.Thread(target=_online_dispatcher, name="online-dispatch", daemon=True).start()
 
     # Try Realtime subscription
     try:
@@ -305,44 +918,28 @@ def start_online_mode():
             event="UPDATE",
             schema="public",
             table="surveys",
-            callback=lambda resp: _handle_online_job(supabase, resp.get("record", {})),
+            callback=lambda resp: _online_jobs.put(resp.get("record", {})),
         )
-        channel.subscribe()
+        channel.subscribe(_on_subscribe_state)
         print("[ONLINE] Realtime subscription active.")
     except Exception as e:
         print(f"[ONLINE] Realtime failed (polling only): {e}")
 
-    # Polling loop
+    # Fallback polling loop (catches events missed while Realtime was down)
     print(f"[ONLINE] Polling every {POLL_INTERVAL}s...")
     tick = 0
     while True:
         try:
-            time.sleep(POLL_INTERVAL)
+            woken = _poll_wake.wait(timeout=POLL_INTERVAL)
+            _poll_wake.clear()
             tick += 1
-            # Lightweight query: only fetch IDs to detect pending jobs
-            # Avoids pulling multi-MB yokai_image_b64 on every poll
-            resp = (
-                supabase.table("surveys")
-                .select("id")
-                .eq("print_triggered", True)
-                .eq("printed", False)
-                .execute()
-            )
-            if resp.data:
-                print(f"[ONLINE] {len(resp.data)} pending job(s).")
-                for stub in resp.data:
-                    # Now fetch full record for this specific job
-                    full = (
-                        supabase.table("surveys")
-                        .select("*")
-                        .eq("id", stub["id"])
-                        .single()
-                        .execute()
-                    )
-                    if full.data:
-                        _handle_online_job(supabase, full.data)
-            elif tick % 6 == 0:
-                # Log a heartbeat every ~60s so we know the poller is alive
+            records = _fetch_pending()
+            if records:
+                print(f"[ONLINE] {len(records)} pending job(s).")
+                for record in records:
+                    _online_jobs.put(record)
+            elif not woken and tick % 5 == 0:
+                # Log a heartbeat every ~5 min so we know the poller is alive
                 print(f"[ONLINE] Heartbeat (tick {tick}): no pending jobs.")
         except KeyboardInterrupt:
             break
@@ -350,29 +947,169 @@ def start_online_mode():
             print(f"[ONLINE] Poll error: {e}")
 
 
-def _handle_online_job(supabase, record):
-    """Process a Supabase record and mark as printed."""
-    if not record or not record.get("print_triggered") or record.get("printed"):
-        return
-    success = print_yokai(record)
-    if success:
+def _fetch_pending():
+    """Fetch full pending print records in one round trip (see supabase/schema.sql)."""
+    client = _get_rest_client()
+    resp = client.post("/rpc/get_pending_prints", json={})
+    if resp.status_code == 404:
+        # Database without the RPC yet: same rows via a plain filtered select
+        print("[ONLINE] get_pending_prints RPC unavailable; using table query.")
+        resp = client.get("/surveys", params={
+            "select": "*",
+            "print_triggered": "eq.true",
+            "printed": "eq.false",
+            "order": "created_at",
+            "limit": str(POLL_BATCH),
+        })
+    resp.raise_for_status()
+    return _json_loads(resp.content)
+
+
+# Set to run the catch-up poll now instead of at the next POLL_INTERVAL tick
+_poll_wake = threading.Event()
+
+
+def _on_subscribe_state(status, err=None):
+    """Realtime (re)joined: anything triggered while it was down is only visible to a poll."""
+    state = getattr(status, "value", status)
+    if state == "SUBSCRIBED":
+        _poll_wake.set()
+    elif err:
+        print(f"[ONLINE] Realtime {state}: {err}")
+
+
+# Realtime callbacks run on the websocket thread: they only enqueue here,
+# and the dispatcher thread does the (slow) printing.
+_online_jobs: queue.Queue = queue.Queue()
+
+
+def _online_dispatcher():
+    while True:
+        # Take everything that has arrived (e.g. a whole poll page) as one batch
+        records = [_online_jobs.get()]
+        while True:
+            try:
+                records.append(_online_jobs.get_nowait())
+            except queue.Empty:
+                break
         try:
-            supabase.table("surveys").update({"printed": True}).eq("id", record["id"]).execute()
-            print(f"[ONLINE] Marked {record['id']} as printed.")
+            _handle_online_batch(records)
         except Exception as e:
-            print(f"[ONLINE] DB update failed: {e}")
+            print(f"[ONLINE] Job error: {e}")
+
+
+# Realtime and the poll can both deliver a record before its printed=true
+# update lands. Ids stay in _in_flight from submission until that update
+# finishes. A poll page read before the update can still arrive after it, so
+# ids also stay in _printed_at for RECENT_PRINTED_TTL; a record for one of
+# those is re-read from the database and printed only if printed was reset
+# (an admin reprint), never on the strength of a possibly stale snapshot.
+RECENT_PRINTED_TTL = 300
+RECENT_PRINTED_MAX = 1000
+_in_flight: set = set()
+_printed_at: "OrderedDict[str, float]" = OrderedDict()  # id -> when printed=true landed
+_in_flight_lock = threading.Lock()  # also updated from the sb-update pool
+
+
+def _release_in_flight(record_ids, printed=False):
+    now = time.monotonic()
+    with _in_flight_lock:
+        _in_flight.difference_update(record_ids)
+        if printed:
+            for record_id in record_ids:
+                _printed_at[record_id] = now
+                _printed_at.move_to_end(record_id)
+
+
+def _printed_recently(record_id):
+    """Caller holds _in_flight_lock."""
+    now = time.monotonic()
+    while _printed_at:
+        oldest_id, ts = next(iter(_printed_at.items()))
+        if now - ts < RECENT_PRINTED_TTL and len(_printed_at) <= RECENT_PRINTED_MAX:
+            break
+        del _printed_at[oldest_id]
+    return record_id in _printed_at
+
+
+def _still_unprinted(record_id):
+    """Re-read a recently printed row: True only if printed has been reset since."""
+    try:
+        resp = _get_rest_client().get("/surveys", params={"select": "printed", "id": f"eq.{record_id}"})
+        resp.raise_for_status()
+        rows = _json_loads(resp.content)
+    except Exception as e:
+        print(f"[ONLINE] Could not re-check {record_id} ({e}); leaving it for the next poll.")
+        return False
+    return bool(rows) and not rows[0].get("printed")
+
+
+def _handle_online_batch(records):
+    """
+    Print a batch of Supabase records and mark the printed ones in one update.
+    All receipts are submitted before waiting, so the printer thread can send
+    them as shared spooler documents (see MAX_COALESCE).
+    """
+    submitted = {}
+    for record in records:
+        if not record or not record.get("print_triggered") or record.get("printed"):
+            continue
+        record_id = record["id"]
+        if record_id in submitted:
+            continue
+        with _in_flight_lock:
+            if record_id in _in_flight:
+                continue
+            recent = _printed_recently(record_id)
+        if recent and not _still_unprinted(record_id):
+            continue
+        with _in_flight_lock:
+            _in_flight.add(record_id)
+        submitted[record_id] = submit_print(record)
+
+    printed = [record_id for record_id, done in submitted.items() if done.result()]
+    failed = [record_id for record_id in submitted if record_id not in printed]
+    if failed:
+        _release_in_flight(failed)  # let the next poll retry them
+    if printed:
+        update = mark_printed_async(printed, "ONLINE")
+        update.add_done_callback(lambda _: _release_in_flight(printed, printed=True))
+        if pending_count():
+            _queue_drain_wake.set()
 
 
 # ──────────────────────────────────────────────
 # Mode B: Offline (Local HTTP API)
 # ──────────────────────────────────────────────
+def _report_enqueue(data, saved):
+    if saved.exception() is not None:
+        print(f"[OFFLINE] Job {data.get('id', 'local')} failed and could not be queued for retry: {saved.exception()}")
+
+
+def _after_offline_print(data, done):
+    """Runs on the printer thread once a /print job has been sent (or failed)."""
+    if done.result():
+        # Mark as printed in Supabase so admin dashboard reflects reality
+        record_id = data.get("id")
+        if record_id:
+            mark_printed_async(record_id, "OFFLINE")
+        if pending_count():
+            _queue_drain_wake.set()  # printer works again: retry queued jobs now
+    else:
+        # Persist for the background retry drain; don't block the printer thread on the write
+        enqueue_job(data).add_done_callback(lambda saved: _report_enqueue(data, saved))
+
+
 def start_offline_mode():
     """
     Run a local Flask server that accepts print jobs via POST.
     The Next.js app (running locally) can POST to this endpoint.
 
     Endpoints:
-        POST /print   — Send a JSON body with yokai_name, yokai_desc, yokai_image_b64
+        POST /print   — Send a JSON body with yokai_name, yokai_desc, and
+                        yokai_image_url (http(s)/file://) or yokai_image_b64;
+                        answers 202 once queued, failures go to the retry queue.
+                        With ?wait=1, answers 200 once printed or 500 on failure
         GET  /health  — Check if the daemon is running
         GET  /status  — Get printer status info
     """
@@ -392,20 +1129,22 @@ def start_offline_mode():
 
     @app.route("/status", methods=["GET"])
     def status():
-        queue = _load_queue()
         return jsonify({
             "status": "ok",
             "printer": PRINTER_NAME,
             "mode": "offline",
             "port": LOCAL_PORT,
-            "queue_length": len(queue),
-            "recent_jobs": _recent_jobs[-10:],
+            "queue_length": pending_count(),
+            "recent_jobs": list(_recent_jobs)[-10:],
         })
 
     @app.route("/print", methods=["POST"])
     def handle_print():
-        data = request.get_json()
-        if not data:
+        try:
+            data = _json_loads(request.get_data())
+        except ValueError:
+            data = None
+        if not data or not isinstance(data, dict):
             return jsonify({"error": "No JSON body"}), 400
 
         name = data.get("yokai_name", "")
@@ -413,29 +1152,29 @@ def start_offline_mode():
             return jsonify({"error": "yokai_name is required"}), 400
 
         print(f"[OFFLINE] Print request received: {name}")
-        success = print_yokai(data)
-
-        if success:
-            # Mark as printed in Supabase so admin dashboard reflects reality
-            record_id = data.get("id")
-            if record_id:
-                sb = _get_supabase()
-                if sb:
-                    try:
-                        sb.table("surveys").update({"printed": True}).eq("id", record_id).execute()
-                        print(f"[OFFLINE] Marked {record_id} as printed in Supabase.")
-                    except Exception as db_err:
-                        print(f"[OFFLINE] Supabase update failed (print was OK): {db_err}")
-            return jsonify({"status": "printed", "yokai_name": name})
-        else:
-            # Enqueue for retry on next daemon cycle
-            enqueue_job(data)
+        done = submit_print(data, allow_file=True)
+        done.add_done_callback(lambda done: _after_offline_print(data, done))
+        if request.args.get("wait") == "1":
+            # Caller needs the outcome (e.g. admin reprint marks printed=true on success)
+            if done.result():
+                return jsonify({"status": "printed", "yokai_name": name})
             return jsonify({"error": "Print failed, job queued for retry"}), 500
+        return jsonify({"status": "queued", "yokai_name": name,
+                        "position": _print_jobs.qsize()}), 202
 
     print(f"[OFFLINE] HTTP API starting on http://0.0.0.0:{LOCAL_PORT}")
     print(f"[OFFLINE] POST http://localhost:{LOCAL_PORT}/print")
     print(f"[OFFLINE] GET  http://localhost:{LOCAL_PORT}/health")
-    app.run(host="0.0.0.0", port=LOCAL_PORT, debug=False)
+    try:
+        from waitress import serve
+    except ImportError:
+        print("[OFFLINE] waitress not installed, using Flask dev server. Run: pip install waitress")
+        app.run(host="0.0.0.0", port=LOCAL_PORT, debug=False, threaded=True)
+        return
+    # /print only parses and queues now, so more handler threads help bursts;
+    # cap connections and drop idle ones so stalled kiosk clients can't pile up
+    serve(app, host="0.0.0.0", port=LOCAL_PORT, threads=8, connection_limit=64,
+          channel_timeout=30, asyncore_use_poll=True)
 
 
 # ──────────────────────────────────────────────
@@ -458,6 +1197,9 @@ def main():
     print("=" * 50)
     print("BAKEBAKE_XR Print Daemon")
     print(f"Printer : {PRINTER_NAME}")
+    # pillow-simd releases carry a ".postN" suffix
+    simd = " (SIMD)" if ".post" in PIL.__version__ else ""
+    print(f"Pillow  : {PIL.__version__}{simd}")
     if args.offline:
         print(f"Mode    : OFFLINE (HTTP on port {LOCAL_PORT})")
     elif args.both:
@@ -466,6 +1208,12 @@ def main():
         print(f"Mode    : ONLINE (Supabase polling)")
     print("=" * 50)
 
+    # Process any jobs left from a previous crash on startup, then keep retrying in the background
+    _migrate_legacy_queue()
+    with _queue_drain_lock:
+        process_queue()
+    threading.Thread(target=_queue_drainer, name="queue-drain", daemon=True).start()
+
     if args.both:
         # Run online mode in a background thread, offline in the main thread
         online_thread = threading.Thread(target=start_online_mode, daemon=True)
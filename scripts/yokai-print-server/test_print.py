@@ -7,93 +7,196 @@ Run this before starting the full print daemon.
 Usage:
     python test_print.py
     python test_print.py "カスタムプリンタ名"
+    python test_print.py --printer "カスタムプリンタ名"
+    python test_print.py --refresh    # ignore the cached printer list
+    python test_print.py --include-network    # also list network printer connections
+
+    The BAKEBAKE_PRINTER environment variable sets the printer when no name is
+    given. Without a TTY the script never prompts; it exits with status 2.
 """
 
+import os
 import sys
+import json
+import time
+import argparse
+import tempfile
+from pathlib import Path
+
+# Printer names from the last enumeration; reused for PRINTER_CACHE_TTL seconds
+# (separate file for --include-network, which lists a different set)
+PRINTER_CACHE = Path(tempfile.gettempdir()) / "bakebake_printers.json"
+PRINTER_CACHE_ALL = Path(tempfile.gettempdir()) / "bakebake_printers_all.json"
+PRINTER_CACHE_TTL = 60
+WRITE_CHUNK_BYTES = 64 * 1024  # payloads above this go to WritePrinter in pieces
+
+# Rule line as underlined double-width spaces (ESC - 2, GS ! 0x10 ... GS ! 0, ESC - 0):
+# 18 cells span the same 432 dots as 18 "━", in 31 bytes instead of 37
+# (36 Kanji bytes + newline) and without font-ROM glyph lookups
+SEPARATOR = b"\x1b\x2d\x02\x1d\x21\x10" + b" " * 18 + b"\x1d\x21\x00\x1b\x2d\x00\n"
+
+# Japanese test lines, pre-encoded as CP932 (Shift_JIS) so nothing is transcoded at runtime
+JP_LINE_1 = (  # "日本語テスト: 妖怪観測記録\n"
+    b"\x93\xfa\x96\x7b\x8c\xea\x83\x65\x83\x58\x83\x67: "
+    b"\x97\x64\x89\xf6\x8a\xcf\x91\xaa\x8b\x4c\x98\x5e\n"
+)
+JP_LINE_2 = (  # "感熱紙に印刷されています。\n"
+    b"\x8a\xb4\x94\x4d\x8e\x86\x82\xc9\x88\xf3\x8d\xfc"
+    b"\x82\xb3\x82\xea\x82\xc4\x82\xa2\x82\xdc\x82\xb7\x81\x42\n"
+)
+
+# The test receipt never changes, so its ESC/POS bytes are built once at import
+_TEMPLATE = b"".join([
+    b"\x1b\x40",          # ESC @ — Initialize printer
+    b"\x1c\x26",          # FS & — Select Kanji character mode
+    b"\x1c\x43\x01",      # FS C 1 — Select Kanji code system: Shift_JIS
+    b"\x1b\x61\x01",      # Center align
+    b"\x1b\x45\x01",      # Bold ON
+    b"\x1d\x21\x11",      # double width/height
+    b"BAKEBAKE_XR\n",
+    b"\x1d\x21\x00",      # Normal size
+    b"\x1b\x45\x00",      # bold OFF
+    SEPARATOR,
+    b"Printer Test OK\nTM-T90II via APD\n",
+    SEPARATOR,
+    b"\n",
+    # Test Japanese text
+    JP_LINE_1,
+    JP_LINE_2,
+    b"\n\n",
+    b"\x1d\x56\x00",      # Cut
+])
+
 
+# Common APD printer names, tried in order
+CANDIDATES = [
+    "EPSON TM-T90II Receipt",
+    "EPSON TM-T90II Receipt5",
+    "EPSON TM-T90II",
+]
 
-def list_printers():
-    """List all Windows printers."""
+
+def _can_open(printer_name):
+    """True if the spooler knows this printer (one OpenPrinter call, no enumeration)."""
     try:
         import win32print
-        flags = win32print.PRINTER_ENUM_LOCAL | win32print.PRINTER_ENUM_CONNECTIONS
-        printers = win32print.EnumPrinters(flags)
-        print("Available printers:")
-        for i, p in enumerate(printers):
-            print(f"  [{i}] {p[2]}")
-        return [p[2] for p in printers]
-    except ImportError:
-        print("Error: pywin32 is not installed. Run: pip install pywin32")
-        return []
+        handle = win32print.OpenPrinter(printer_name)
+    except Exception:
+        return False
+    win32print.ClosePrinter(handle)
+    return True
+
+
+def _load_cached_printers(cache):
+    """Printer names from `cache` if it is younger than PRINTER_CACHE_TTL, else None."""
+    try:
+        if time.time() - os.path.getmtime(cache) < PRINTER_CACHE_TTL:
+            return json.loads(cache.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def enumerate_printers(refresh=False, include_network=False):
+    """
+    Names of the local Windows printers (cached for PRINTER_CACHE_TTL seconds
+    unless refresh). The TM-T90II is a local USB queue, so network connections
+    are only listed with include_network: enumerating them contacts each print
+    server and stalls when one is unreachable.
+    """
+    cache = PRINTER_CACHE_ALL if include_network else PRINTER_CACHE
+    names = None if refresh else _load_cached_printers(cache)
+    if names is None:
+        try:
+            import win32print
+        except ImportError:
+            print("Error: pywin32 is not installed. Run: pip install pywin32")
+            return []
+        flags = win32print.PRINTER_ENUM_LOCAL
+        if include_network:
+            flags |= win32print.PRINTER_ENUM_CONNECTIONS
+        # Level 4 (PRINTER_INFO_4) is names/attributes only: no per-printer OpenPrinter
+        names = [p["pPrinterName"] for p in win32print.EnumPrinters(flags, None, 4)]
+        try:
+            cache.write_text(json.dumps(names, ensure_ascii=False), encoding="utf-8")
+        except OSError:
+            pass
+    return names
 
 
-def _raw_text(p, text):
-    """Send text encoded as CP932 (Shift_JIS) for Japanese support."""
-    p._raw(text.encode("cp932", errors="replace"))
+def print_printers(names):
+    """Show the numbered printer list for the interactive pick."""
+    print("Available printers:")
+    for i, name in enumerate(names):
+        print(f"  [{i}] {name}")
+
+
+def _write_all(win32print, handle, data):
+    """
+    Write data inside the open document: one WritePrinter call when it fits
+    in WRITE_CHUNK_BYTES, otherwise 64 KiB pieces (e.g. once logos are added).
+    """
+    view = memoryview(data)
+    while view:
+        written = win32print.WritePrinter(handle, bytes(view[:WRITE_CHUNK_BYTES]))
+        if written <= 0:
+            raise OSError("WritePrinter accepted no data")
+        view = view[written:]
 
 
 def test_print(printer_name):
     """Send a test receipt to the printer using raw ESC/POS with Kanji mode."""
-    from escpos.printer import Win32Raw
+    import win32print
 
     print(f"\nConnecting to: {printer_name}")
-    p = Win32Raw(printer_name)
-
-    print("Sending test print...")
-
-    # ESC @ — Initialize printer
-    p._raw(b"\x1b\x40")
-    # FS & — Select Kanji character mode
-    p._raw(b"\x1c\x26")
-    # FS C 1 — Select Kanji code system: Shift_JIS
-    p._raw(b"\x1c\x43\x01")
-
-    # Center align
-    p._raw(b"\x1b\x61\x01")
-    # Bold ON + double width/height
-    p._raw(b"\x1b\x45\x01")
-    p._raw(b"\x1d\x21\x11")
-    _raw_text(p, "BAKEBAKE_XR\n")
-
-    # Normal size, bold OFF
-    p._raw(b"\x1d\x21\x00")
-    p._raw(b"\x1b\x45\x00")
-    _raw_text(p, "━━━━━━━━━━━━━━━━━━\n")
-    _raw_text(p, "Printer Test OK\n")
-    _raw_text(p, "TM-T90II via APD\n")
-    _raw_text(p, "━━━━━━━━━━━━━━━━━━\n\n")
-
-    # Test Japanese text
-    _raw_text(p, "日本語テスト: 妖怪観測記録\n")
-    _raw_text(p, "感熱紙に印刷されています。\n\n\n")
-
-    # Cut
-    p._raw(b"\x1d\x56\x00")
+    handle = win32print.OpenPrinter(printer_name)
+    try:
+        print("Sending test print...")
+        # One RAW spooler document with a single write; EndDocPrinter sends it
+        win32print.StartDocPrinter(handle, 1, ("BAKEBAKE Test", None, "RAW"))
+        try:
+            win32print.StartPagePrinter(handle)
+            _write_all(win32print, handle, _TEMPLATE)
+            win32print.EndPagePrinter(handle)
+        finally:
+            win32print.EndDocPrinter(handle)
+    finally:
+        win32print.ClosePrinter(handle)
 
     print("Test print sent successfully!")
     print("Check the printer for output.")
 
 
 if __name__ == "__main__":
-    names = list_printers()
-
-    if len(sys.argv) > 1:
-        printer_name = sys.argv[1]
-    else:
-        # Try common APD names
-        candidates = [
-            "EPSON TM-T90II Receipt",
-            "EPSON TM-T90II Receipt5",
-            "EPSON TM-T90II",
-        ]
-        printer_name = None
-        for c in candidates:
-            if c in names:
-                printer_name = c
+    parser = argparse.ArgumentParser(description="BAKEBAKE_XR Printer Test")
+    parser.add_argument("printer", nargs="?", help="Printer name (default: auto-detect)")
+    parser.add_argument("--printer", dest="printer_opt", metavar="NAME", help="Printer name (same as the positional)")
+    parser.add_argument("--refresh", action="store_true", help="Re-enumerate printers instead of using the cache")
+    parser.add_argument("--include-network", action="store_true", help="Also list network printer connections")
+    args = parser.parse_args()
+
+    # Known name: go straight to the test, no enumeration
+    printer_name = args.printer_opt or args.printer or os.environ.get("BAKEBAKE_PRINTER")
+    if not printer_name:
+        # Fast path: open the common APD names directly
+        printer_name = next((c for c in CANDIDATES if _can_open(c)), None)
+
+    if not printer_name:
+        names = enumerate_printers(refresh=args.refresh, include_network=args.include_network)
+        # Windows printer names are case-insensitive: map casefolded -> real name
+        lut = {n.casefold(): n for n in names}
+        for c in CANDIDATES:
+            real = lut.get(c.casefold())
+            if real:
+                printer_name = real
                 break
 
         if not printer_name and names:
+            if not sys.stdin.isatty():
+                print("No known EPSON printer found. Pass --printer or set BAKEBAKE_PRINTER.")
+                sys.exit(2)
             # Ask user to pick
+            print_printers(names)
             print("\nNo known EPSON printer found automatically.")
             print("Enter the number of the printer to test, or the full name:")
             choice = input("> ").strip()
@@ -65,11 +65,12 @@ export async function POST(req: NextRequest) {
         }
 
         // Also try direct push to local daemon
-        // If successful, immediately mark printed=true to prevent double-print
-        // from Supabase poller in --both mode
+        // If it actually printed, immediately mark printed=true to prevent double-print
+        // from Supabase poller in --both mode. ?wait=1 makes the daemon answer 200 only
+        // after printing (without it, 202 just means "queued").
         let localResult: string = 'skipped';
         try {
-            const resp = await fetch(`${LOCAL_DAEMON_URL}/print`, {
+            const resp = await fetch(`${LOCAL_DAEMON_URL}/print?wait=1`, {
                 method: 'POST',
                 headers: { 'Content-Type': 'application/json' },
                 body: JSON.stringify({
@@ -79,7 +80,7 @@ export async function POST(req: NextRequest) {
                     yokai_image_b64: record.yokai_image_b64,
                 }),
             });
-            if (resp.ok) {
+            if (resp.status === 200) {
                 localResult = 'sent';
                 // Mark printed=true so online poller won't re-print
                 await supabase.from('surveys').update({ printed: true }).eq('id', id);
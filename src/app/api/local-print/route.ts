@@ -7,7 +7,10 @@ import { NextRequest, NextResponse } from 'next/server';
  * Forwards print data to the local print daemon running on the same PC.
  *
  * Expected JSON body:
- *   { yokai_name, yokai_desc?, yokai_image_b64? }
+ *   { yokai_name, yokai_desc?, yokai_image_url?, yokai_image_b64? }
+ *
+ * Prefer yokai_image_url (Supabase Storage URL or file:// path) over inline
+ * base64 so large images are not embedded in the request body.
  *
  * The print daemon should be running with:
  *   python print_daemon.py --offline
@@ -55,3 +55,14 @@ CREATE POLICY "Enable select for anonymous users" ON public.surveys
 -- Enable Realtime for the surveys table (required for the print daemon)
 -- Note: You may also need to enable Realtime for this table in the Supabase Dashboard UI (Database -> Publications -> supabase_realtime)
 ALTER PUBLICATION supabase_realtime ADD TABLE public.surveys;
+
+-- Pending print jobs for the print daemon (oldest first), fetched in a single round trip
+CREATE OR REPLACE FUNCTION public.get_pending_prints()
+RETURNS SETOF public.surveys
+LANGUAGE sql STABLE
+AS $$
+    SELECT * FROM public.surveys
+    WHERE print_triggered AND NOT printed
+    ORDER BY created_at
+    LIMIT 50;
+$$;